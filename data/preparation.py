@@ -1,9 +1,42 @@
+from dataclasses import asdict, dataclass
 from enum import Enum, auto
-from json import dumps
-from typing import Dict, Union
+from typing import Dict, List, Set, Union
 
+import numpy as np
 import pandas as pd
 
+try:
+    from orjson import dumps as _dump_json_bytes
+except ImportError:
+    from json import dumps as _dumps
+
+    def _dump_json_bytes(metadata: Dict) -> bytes:
+        return _dumps(metadata, ensure_ascii=False).encode("utf8")
+
+
+try:
+    from numba import njit
+
+    @njit(cache=True, parallel=False)
+    def _combine_keys(codes: np.ndarray) -> np.ndarray:
+        """Folds a (levels, rows) array of index level codes into one 64-bit composite key per row"""
+        n_levels, n_rows = codes.shape
+        keys = np.zeros(n_rows, dtype=np.uint64)
+        for row in range(n_rows):
+            key = np.uint64(0)
+            for level in range(n_levels):
+                key = key * np.uint64(0x9E3779B97F4A7C15) + np.uint64(codes[level, row])
+            keys[row] = key
+        return keys
+except ImportError:
+
+    def _combine_keys(codes: np.ndarray) -> np.ndarray:
+        """Folds a (levels, rows) array of index level codes into one 64-bit composite key per row"""
+        keys = np.zeros(codes.shape[1], dtype=np.uint64)
+        for level_codes in codes:
+            keys = keys * np.uint64(0x9E3779B97F4A7C15) + level_codes.astype(np.uint64)
+        return keys
+
 
 class DataPreparationException(Exception):
     """An error that occurred during data preparation"""
@@ -15,27 +48,31 @@ class _Type(Enum):
     Metadata = auto()
 
 
-class Metadatum(Enum):
-    """Defines which metadata exist for plot data columns"""
-    Label = auto()
-    Unit = auto()
+@dataclass(frozen=True, slots=True)
+class ColumnMeta:
+    """Metadata of one plot data column"""
+    label: str
+    unit: str = ""
+
+    def __post_init__(self) -> None:
+        if not self.label or (isinstance(self.label, str) and not self.label.replace(" ", "")):
+            raise DataPreparationException("Column label must not be missing, empty or whitespaces only.")
 
 
-def column_metadata(label: str, unit: str = "") -> Dict[Metadatum, str]:
+def column_metadata(label: str, unit: str = "") -> ColumnMeta:
     """
-    Creates a metadata dictionary from given input
+    Creates a column metadata object from given input
 
     Args:
         label: full label of the column - as to be displayed for axis descriptions - must not be empty
         unit: of the associated data
 
     Returns:
-        dictionary of the metadata
+        metadata of the column
     """
-    if not label or (isinstance(label, str) and not label.replace(" ", "")):
+    if not label:
         raise DataPreparationException("Column label must not be missing, empty or whitespaces only.")
-
-    return {Metadatum.Label: str(label), Metadatum.Unit: str(unit)}
+    return ColumnMeta(label=str(label), unit=str(unit))
 
 
 class DataPreparer:
@@ -44,6 +81,11 @@ class DataPreparer:
     def __init__(self) -> None:
         """Create a new DataPreparer"""
         self.datasets: Dict[str, Dict[_Type, Union[pd.DataFrame, Dict]]] = {}
+        self._pending_columns: Dict[str, List[pd.Series]] = {}
+        self._pending_rows: Dict[str, Dict[str, List[pd.Series]]] = {}
+        self._metadata_cache: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self._dirty_metadata: Set[str] = set()
+        self._column_names: Dict[str, Set[str]] = {}
 
     def save_to_file(self, out_file_path: str) -> None:
         """
@@ -52,16 +94,63 @@ class DataPreparer:
         Args:
             out_file_path: name of file to write
         """
-        if not any([extension in out_file_path for extension in ["h5", "hdf5", "he5"]]):
+        store = self._open_store(out_file_path)
+        try:
+            self._write_to_store(store)
+        finally:
+            store.close()
+
+    @classmethod
+    def save_many(cls, out_file_path: str, preparers: List["DataPreparer"]) -> None:
+        """
+        Write data of all given preparers to one file in hdf5 format, opening and syncing the file only once
+
+        Args:
+            out_file_path: name of file to write
+            preparers: preparers whose data groups are all written to the file
+
+        Raises:
+            DataPreparationException: if two preparers share a data group name
+        """
+        store = cls._open_store(out_file_path)
+        written: Set[str] = set()
+        try:
+            for preparer in preparers:
+                duplicates = written.intersection(preparer.datasets)
+                if duplicates:
+                    raise DataPreparationException(f"Group names {sorted(duplicates)} occur in more than one preparer.")
+                preparer._write_to_store(store)
+                written.update(preparer.datasets)
+            store.flush(fsync=False)
+        finally:
+            store.close()
+
+    @staticmethod
+    def _open_store(out_file_path: str) -> pd.HDFStore:
+        """
+        Opens a new hdf5 store for writing, appending the default file extension if required
+
+        Args:
+            out_file_path: name of file to write
+
+        Returns:
+            store opened in write mode
+        """
+        if not out_file_path.endswith((".h5", ".hdf5", ".he5")):
             out_file_path = f"{out_file_path}.hdf5"
+        return pd.HDFStore(path=out_file_path, mode="w", complib="blosc:lz4", complevel=5, fletcher32=False)
+
+    def _write_to_store(self, store: pd.HDFStore) -> None:
+        """
+        Write all data groups and their metadata to given open store
 
-        store = pd.HDFStore(path=out_file_path, mode="w")
-        for key, item in self.datasets.items():
-            store.put(key=key, value=self._group_by_index(item[_Type.Data]))
-            metadata = self._convert_enums(item[_Type.Metadata])
-            store.get_storer(key=key).attrs.plot_metadata = dumps(metadata, ensure_ascii=False).encode(
-                'utf8')
-        store.close()
+        Args:
+            store: open hdf5 store to write to
+        """
+        for key in self.datasets:
+            store.put(key=key, value=self._group_by_index(self._flush(key)), format="fixed")
+            metadata = self._convert_metadata(key)
+            store.get_storer(key=key).attrs.plot_metadata = _dump_json_bytes(metadata)
 
     @staticmethod
     def _group_by_index(data: pd.DataFrame) -> pd.DataFrame:
@@ -74,29 +163,93 @@ class DataPreparer:
         Returns:
             compressed data with
         """
-        return data.groupby(list(data.index.names)).sum()
+        if data.index.is_unique:
+            result = data
+        elif len(data) == 0 or any(dtype.kind not in "iuf" for dtype in data.dtypes):
+            result = data.groupby(level=list(range(data.index.nlevels)), sort=False, observed=True).sum()
+        else:
+            result = DataPreparer._grouped_sum(data)
+        return DataPreparer._compact_index(result)
 
     @staticmethod
-    def _convert_enums(metadata: Dict[str, Dict[Enum, str]]) -> Dict[str, Dict[str, str]]:
+    def _compact_index(data: pd.DataFrame) -> pd.DataFrame:
         """
-        Turn inner keys of a dictionary from enum into lower-case strings
+        Replaces a contiguous integer index by an equivalent RangeIndex that needs no per-row storage
 
         Args:
-            metadata: dictionary with enum keys
+            data: dataframe whose index may be compacted
 
         Returns:
-            the same dictionary but with lower-case string keys instead of enums in its inner dictionaries
+            the same data, with its index replaced by a RangeIndex if the values form a contiguous range
         """
-        return {k: {enum.name.lower(): v for enum, v in entries.items()} for k, entries in metadata.items()}
+        index = data.index
+        if index.nlevels == 1 and len(index) > 0 and index.dtype.kind in "iu":
+            start = index.min()
+            if np.array_equal(index.values, np.arange(start, start + len(index))):
+                data.index = pd.RangeIndex(start=start, stop=start + len(index), name=index.name)
+        return data
 
-    def init_data_group(self, group: str, key_metadata: Dict[str, Dict[Metadatum, str]]) -> None:
+    @staticmethod
+    def _grouped_sum(data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Sums rows of numeric data sharing the same index entry using factorised level codes and bincount
+
+        Args:
+            data: dataframe with numeric value columns to be compressed
+
+        Returns:
+            compressed data with one row per distinct index entry
+        """
+        codes = [
+            pd.factorize(data.index.get_level_values(level), sort=False, use_na_sentinel=False)[0]
+            for level in range(data.index.nlevels)
+        ]
+        key = codes[0] if len(codes) == 1 else _combine_keys(np.asarray(codes))
+        _, first_positions, inverse = np.unique(key, return_index=True, return_inverse=True)
+
+        # np.unique orders by key value, i.e. arbitrarily for hashed keys; restore first-occurrence order
+        order = np.argsort(first_positions)
+        first_positions = first_positions[order]
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        inverse = rank[inverse]
+
+        aggregated = {}
+        for name, column in data.items():
+            values = column.to_numpy()
+            if values.dtype.kind in "iu":
+                summed = np.zeros(len(first_positions), dtype=values.dtype)
+                np.add.at(summed, inverse, values)
+            else:
+                summed = np.bincount(inverse, weights=np.nan_to_num(values), minlength=len(first_positions))
+            aggregated[name] = summed
+        return pd.DataFrame(aggregated, index=data.index[first_positions])
+
+    def _convert_metadata(self, group: str) -> Dict[str, Dict[str, str]]:
+        """
+        Turn the column metadata of given group into plain dictionaries for serialization
+
+        Args:
+            group: data group whose metadata are to be converted
+
+        Returns:
+            the group's metadata as dictionary of plain string-keyed dictionaries; cached per group and
+            rebuilt only after the metadata changed
+        """
+        if group in self._dirty_metadata or group not in self._metadata_cache:
+            metadata = self.datasets[group][_Type.Metadata]
+            self._metadata_cache[group] = {k: asdict(entries) for k, entries in metadata.items()}
+            self._dirty_metadata.discard(group)
+        return self._metadata_cache[group]
+
+    def init_data_group(self, group: str, key_metadata: Dict[str, ColumnMeta]) -> None:
         """
         Initialise a new data group under given name and metadata for each key column
 
         Args:
             group: (unique) name for the new data group that is used to address the data during plotting
             key_metadata: metadata description of **all** key columns as dictionary of shape
-                {column_name: dict_of_column_metadata}
+                {column_name: column_metadata}
 
         Raises:
             DataPreparationException: if group name already exists
@@ -112,6 +265,10 @@ class DataPreparer:
             _Type.Data: empty_df,
             _Type.Metadata: key_metadata,
         }
+        self._pending_columns[str(group)] = []
+        self._pending_rows[str(group)] = {}
+        self._dirty_metadata.add(str(group))
+        self._column_names[str(group)] = set()
 
     def _ensure_valid_group(self, group: str) -> None:
         """
@@ -130,7 +287,7 @@ class DataPreparer:
             raise DataPreparationException(f"Group name '{group}' already exists.")
 
     @staticmethod
-    def _ensure_valid_key_metadata(metadata: Dict[str, Dict[Metadatum, str]]) -> None:
+    def _ensure_valid_key_metadata(metadata: Dict[str, ColumnMeta]) -> None:
         """
         Raises DataPreparationException if metadata are empty or invalid
 
@@ -150,7 +307,7 @@ class DataPreparer:
             DataPreparer._ensure_valid_column_metadata(metadata_of_column)
 
     @staticmethod
-    def _ensure_valid_column_metadata(metadata: Dict[Metadatum, str]) -> None:
+    def _ensure_valid_column_metadata(metadata: ColumnMeta) -> None:
         """
         Raises DataPreparationException if column metadata are not in the required format
 
@@ -160,36 +317,90 @@ class DataPreparer:
         Raises:
             DataPreparationException: if metadata are empty or invalid
         """
-        error_msg = "Column metadata invalid! Use function 'column_metadata' to create them!"
-        if Metadatum.Label not in metadata.keys():
-            raise DataPreparationException(error_msg)
-        for key in metadata.keys():
-            if key not in [e for e in Metadatum]:
-                raise DataPreparationException(error_msg)
-
-    # def add_value_column(self, group: str, column: pd.Series, metadata: Dict[Metadatum, str]) -> None:
-    #     """
-    #     Add a value column to an existing data group with the associated metadata
-    #
-    #     Args:
-    #         group: name of data group to add the column to
-    #         column: data of the column - (multi)index must match that of the data group
-    #         metadata: metadata description of the column
-    #
-    #     Raises:
-    #         DataPreparationException:
-    #             * if group name was not yet initialised,
-    #             * if column data index does not match that of the group
-    #     """
-    #     self._assert_group_name_exists(group)
-    #     container = self.datasets[group][_Type.Data]
-    #     self._assert_indexes_match(container, column)
-    #     column = self._ensure_is_series(column)
-    #
-    #     self.datasets[group][_Type.Data] = pd.concat([container, column], axis=1)
-    #     self.datasets[group][_Type.Metadata].update({column.name: metadata})
-
-    def add_values(self, group: str, series: pd.Series, metadata: Dict[Metadatum, str] = None) -> None:
+        if not isinstance(metadata, ColumnMeta):
+            raise DataPreparationException("Column metadata invalid! Use function 'column_metadata' to create them!")
+
+    def add_value_column(self, group: str, column: pd.Series, metadata: ColumnMeta) -> None:
+        """
+        Add a value column to an existing data group with the associated metadata
+
+        Args:
+            group: name of data group to add the column to
+            column: data of the column - (multi)index must match that of the data group
+            metadata: metadata description of the column
+
+        Raises:
+            DataPreparationException:
+                * if group name was not yet initialised,
+                * if column data index does not match that of the group
+                * if metadata are missing or invalid
+        """
+        self._assert_group_name_exists(group)
+        container = self.datasets[group][_Type.Data]
+        self._assert_indexes_match(container, column)
+        column = self._ensure_is_series(column)
+        self._ensure_valid_column_metadata(metadata)
+
+        self._pending_columns[group].append(column)
+        self._column_names[group].add(column.name)
+        self.datasets[group][_Type.Metadata].update({column.name: metadata})
+        self._dirty_metadata.add(group)
+
+    def _materialize(self, group: str) -> pd.DataFrame:
+        """
+        Merges all staged columns of given group into its dataframe in a single concat and returns the result
+
+        Args:
+            group: data group to be materialised
+
+        Returns:
+            dataframe of the group including all columns added so far
+        """
+        pending = self._pending_columns[group]
+        if pending:
+            container = self.datasets[group][_Type.Data]
+            self.datasets[group][_Type.Data] = self._merge_columns(container, pending)
+            pending.clear()
+        return self.datasets[group][_Type.Data]
+
+    @staticmethod
+    def _merge_columns(container: pd.DataFrame, columns: List[pd.Series]) -> pd.DataFrame:
+        """
+        Merges given columns into the container dataframe
+
+        Args:
+            container: dataframe the columns are merged into
+            columns: staged columns to be merged
+
+        Returns:
+            dataframe containing the container's and all given columns
+        """
+        if container.empty and len(container.columns) == 0 and all(
+                column.index.equals(columns[0].index) for column in columns[1:]):
+            return pd.DataFrame(
+                {column.name: column.to_numpy() for column in columns}, index=columns[0].index, copy=False
+            )
+        return pd.concat([container] + columns, axis=1, sort=False)
+
+    def _flush(self, group: str) -> pd.DataFrame:
+        """
+        Merges all staged row batches of given group into its dataframe in a single concat and returns the result
+
+        Args:
+            group: data group to be flushed
+
+        Returns:
+            dataframe of the group including all rows added so far
+        """
+        container = self._materialize(group)
+        pending = self._pending_rows[group]
+        if pending:
+            columns = [pd.DataFrame(pd.concat(batches, axis=0)) for batches in pending.values()]
+            self.datasets[group][_Type.Data] = pd.concat([container] + columns, axis=0, sort=False)
+            pending.clear()
+        return self.datasets[group][_Type.Data]
+
+    def add_values(self, group: str, series: pd.Series, metadata: ColumnMeta = None) -> None:
         """
         Add value rows to a new or existing column in an existing data group
 
@@ -206,17 +417,19 @@ class DataPreparer:
                 * if a dataframe with more than one column is passed
         """
         self._assert_group_name_exists(group)
-        container = self.datasets[group][_Type.Data]
+        container = self._materialize(group)
         self._assert_indexes_match(container, series)
         series = self._ensure_is_series(series)
 
-        if series.name not in list(container.columns):
+        if series.name not in self._column_names[group]:
             if not metadata:
                 raise DataPreparationException(f"No metadata specified for new column '{series.name}'.")
             self._ensure_valid_column_metadata(metadata)
+            self._column_names[group].add(series.name)
             self.datasets[group][_Type.Metadata].update({series.name: metadata})
+            self._dirty_metadata.add(group)
 
-        self.datasets[group][_Type.Data] = pd.concat([container, pd.DataFrame(series)], axis=0)
+        self._pending_rows[group].setdefault(series.name, []).append(series)
 
     def _assert_group_name_exists(self, group) -> None:
         """
@@ -243,14 +456,17 @@ class DataPreparer:
         Raises:
             DataPreparationException: if column data index does not match that of the group
         """
-        group_index = container.index.names
-        column_index = column.index.names
+        group_index = tuple(container.index.names)
+        column_index = tuple(column.index.names)
+        if group_index == column_index:
+            return
         if len(group_index) != len(column_index):
             raise DataPreparationException(
                 f"Length of index in column to add does not match that of the assigned data group.")
-        for index_column in group_index:
-            if index_column not in column_index:
-                raise DataPreparationException(f"Index column '{index_column}' not found in index of column to add.")
+        column_index_set = frozenset(column_index)
+        missing = [index_column for index_column in group_index if index_column not in column_index_set]
+        if missing:
+            raise DataPreparationException(f"Index columns {missing} not found in index of column to add.")
 
     @staticmethod
     def _ensure_is_series(series: Union[pd.Series, pd.DataFrame]) -> pd.Series:
@@ -1,5 +1,3 @@
-import uuid
-from random import randint
 import streamlit as st
 # from header import load_header
 
@@ -7,13 +5,13 @@ import streamlit as st
 def create_layout(elements):
 
     for i, element in enumerate(elements):
-        simple_layout(key=i, **element)
+        simple_layout(key=f"{element['radio_label']}:{i}", **element)
 
 
 def simple_layout(
         radio_label: str, radio_options: list[str],
         plotting_function: object, radio_kwargs: dict=None,
-        key: int=0
+        key: str="0"
     ):
 
     radio_kwargs = radio_kwargs if radio_kwargs is not None else {}
@@ -1,3 +1,5 @@
+import numpy as np
+from bokeh.models import ColumnDataSource
 from bokeh.plotting import figure
 
 
@@ -18,19 +20,23 @@ class Line:
             self.figure_kwargs = figure_kwargs if figure_kwargs is not None else {}
             self.line_kwargs = line_kwargs if line_kwargs is not None else {}
 
-    def __call__(self, option):
-        fig = figure(
-            title=self.title,
-            x_axis_label=self.x_axis_label,
-            y_axis_label=self.y_axis_label
-        )
+            self._x = np.ascontiguousarray(self.data.index.values)
+            self._y_cache = {}
 
-        x, y = self._slice(option)
+            self._source = ColumnDataSource(data={"x": [], "y": []})
+            self._fig = figure(
+                title=self.title,
+                x_axis_label=self.x_axis_label,
+                y_axis_label=self.y_axis_label
+            )
+            self._fig.line("x", "y", source=self._source, legend_label=self.legend_label, line_width=2)
 
-        fig.line(x, y, legend_label=self.legend_label, line_width=2)
-        return fig
+    def __call__(self, option):
+        x, y = self._slice(option)
+        self._source.data = {"x": x, "y": y}
+        return self._fig
 
     def _slice(self, option):
-        x = self.data.index
-        y = self.data[option].values
-        return x, y
\ No newline at end of file
+        if option not in self._y_cache:
+            self._y_cache[option] = self.data[option].to_numpy(copy=False)
+        return self._x, self._y_cache[option]
\ No newline at end of file
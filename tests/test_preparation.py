@@ -3,19 +3,17 @@ import os
 import pandas as pd
 import pytest
 
-from data.preparation import column_metadata, Metadatum, DataPreparationException, DataPreparer
+from data.preparation import column_metadata, ColumnMeta, DataPreparationException, DataPreparer
 
 
 def test__column_metadata__with_label__returns():
     result = column_metadata(label="MyLabel")
-    assert Metadatum.Label in result.keys()
-    assert result[Metadatum.Label] == "MyLabel"
+    assert result.label == "MyLabel"
 
 
 def test__column_metadata__no_unit__returns_empty_unit():
     result = column_metadata(label="MyLabel")
-    assert Metadatum.Label in result.keys()
-    assert result[Metadatum.Unit] == ""
+    assert result.unit == ""
 
 
 @pytest.mark.parametrize("label", [None, "", " "])
@@ -27,16 +25,14 @@ def test__column_metadata__invalid_label__fails(label):
 
 def test__column_metadata__with_label_and_unit__returns_both():
     result = column_metadata(label="ALabel", unit="m/s")
-    assert Metadatum.Label in result.keys()
-    assert result[Metadatum.Label] == "ALabel"
-    assert Metadatum.Unit in result.keys()
-    assert result[Metadatum.Unit] == "m/s"
+    assert result.label == "ALabel"
+    assert result.unit == "m/s"
 
 
 def test__column_metadata__int_label__returns_converted():
     # noinspection PyTypeChecker
     result = column_metadata(label=4, unit="m/s")
-    assert result[Metadatum.Label] == "4"
+    assert result.label == "4"
 
 
 class TestDataPreparer:
@@ -62,6 +58,31 @@ class TestDataPreparer:
             assert os.path.isfile(path)
             os.remove(path)
 
+    def test__save_many__two_preparers__all_groups_in_one_file(self):
+        path = "./deleteFile.hdf5"
+        preparers = []
+        for group in ["GroupA", "GroupB"]:
+            preparer = DataPreparer()
+            preparer.init_data_group(group=group, key_metadata={"ColA": column_metadata(label="A")})
+            preparers.append(preparer)
+        DataPreparer.save_many(path, preparers)
+        store = pd.HDFStore(path=path, mode="r")
+        keys = store.keys()
+        store.close()
+        os.remove(path)
+        assert sorted(keys) == ["/GroupA", "/GroupB"]
+
+    def test__save_many__duplicate_group__fails(self):
+        path = "./deleteFile.hdf5"
+        preparers = []
+        for _ in range(2):
+            preparer = DataPreparer()
+            preparer.init_data_group(group="Group", key_metadata={"ColA": column_metadata(label="A")})
+            preparers.append(preparer)
+        with pytest.raises(DataPreparationException):
+            DataPreparer.save_many(path, preparers)
+        os.remove(path)
+
     @pytest.mark.parametrize("group", [None, "", " "])
     def test__init_data_group__group_key_invalid__fails(self, group):
         preparer = DataPreparer()
@@ -81,15 +102,45 @@ class TestDataPreparer:
             # noinspection PyTypeChecker
             preparer.init_data_group(group="MyGroup", key_metadata=metadata)
 
-    @pytest.mark.parametrize("metadata", [{"Col": {Metadatum.Unit: "MyUnit"}},
+    @pytest.mark.parametrize("metadata", [{"Col": {"unit": "MyUnit"}},
                                           {"Col": {"label": "SomeLabel"}},
-                                          {"Col": {Metadatum.Label: "Label", "unknown_key": "a"}}])
+                                          {"Col": "NotColumnMeta"}])
     def test__init_data_group__column_metadata_invalid__fails(self, metadata):
         preparer = DataPreparer()
         with pytest.raises(DataPreparationException):
             # noinspection PyTypeChecker
             preparer.init_data_group(group="MyGroup", key_metadata=metadata)
 
+    def test__add_value_column__group_missing__fails(self):
+        preparer = DataPreparer()
+        with pytest.raises(DataPreparationException):
+            preparer.add_value_column(group="MissingGroup", column=pd.Series(), metadata=column_metadata(label="A"))
+
+    @pytest.mark.parametrize("metadata", [{}, {"unit": "MyUnit"}, "NotColumnMeta"])
+    def test__add_value_column__invalid_metadata__fails(self, metadata):
+        preparer = DataPreparer()
+        preparer.init_data_group(group="Group", key_metadata={"ColA": column_metadata(label="A")})
+        series = pd.Series(data=[0], index=[0])
+        series.index.name = "ColA"
+        with pytest.raises(DataPreparationException):
+            # noinspection PyTypeChecker
+            preparer.add_value_column(group="Group", column=series, metadata=metadata)
+
+    def test__add_value_column__multiple_columns__all_saved(self):
+        path = "./deleteFile.hdf5"
+        preparer = DataPreparer()
+        preparer.init_data_group(group="Group", key_metadata={"ColA": column_metadata(label="A")})
+        for name in ["Value1", "Value2"]:
+            series = pd.Series(data=[1.0, 2.0], index=[0, 1], name=name)
+            series.index.name = "ColA"
+            preparer.add_value_column(group="Group", column=series, metadata=column_metadata(label=name))
+        preparer.save_to_file(path)
+        store = pd.HDFStore(path=path, mode="r")
+        saved = store.get("Group")
+        store.close()
+        os.remove(path)
+        assert list(saved.columns) == ["Value1", "Value2"]
+
     def test__add_values__group_missing__fails(self):
         preparer = DataPreparer()
         with pytest.raises(DataPreparationException):
@@ -135,9 +186,7 @@ class TestDataPreparer:
         # noinspection PyTypeChecker
         preparer.add_values(group="Group", series=df, metadata=column_metadata(label="1"))
 
-    @pytest.mark.parametrize("metadata", [{}, {"Col": {Metadatum.Unit: "MyUnit"}},
-                                          {"Col": {"label": "SomeLabel"}},
-                                          {"Col": {Metadatum.Label: "Label", "unknown_key": "a"}}])
+    @pytest.mark.parametrize("metadata", [{}, {"unit": "MyUnit"}, {"label": "SomeLabel"}, "NotColumnMeta"])
     def test__add_values__new_column_invalid_metadata__fails(self, metadata):
         preparer = DataPreparer()
         preparer.init_data_group(group="Group", key_metadata={"ColA": column_metadata(label="A")})
@@ -147,6 +196,71 @@ class TestDataPreparer:
             # noinspection PyTypeChecker
             preparer.add_values(group="Group", series=series, metadata=metadata)
 
+    def test__add_values__multiple_batches__all_rows_saved(self):
+        path = "./deleteFile.hdf5"
+        preparer = DataPreparer()
+        preparer.init_data_group(group="Group", key_metadata={"ColA": column_metadata(label="A")})
+        series = pd.Series(data=[1.0, 2.0], index=[0, 1], name="MyValueColumn")
+        series.index.name = "ColA"
+        preparer.add_values(group="Group", series=series, metadata=column_metadata(label="SomeLabel"))
+        series2 = pd.Series(data=[3.0, 4.0], index=[2, 3], name="MyValueColumn")
+        series2.index.name = "ColA"
+        preparer.add_values(group="Group", series=series2, metadata={})
+        preparer.save_to_file(path)
+        store = pd.HDFStore(path=path, mode="r")
+        saved = store.get("Group")
+        store.close()
+        os.remove(path)
+        assert list(saved["MyValueColumn"]) == [1.0, 2.0, 3.0, 4.0]
+
+    def test__add_values__duplicate_index__summed_on_save(self):
+        path = "./deleteFile.hdf5"
+        preparer = DataPreparer()
+        preparer.init_data_group(group="Group", key_metadata={"ColA": column_metadata(label="A")})
+        series = pd.Series(data=[1.0, 2.0], index=[0, 1], name="MyValueColumn")
+        series.index.name = "ColA"
+        preparer.add_values(group="Group", series=series, metadata=column_metadata(label="SomeLabel"))
+        series2 = pd.Series(data=[3.0, 4.0], index=[0, 1], name="MyValueColumn")
+        series2.index.name = "ColA"
+        preparer.add_values(group="Group", series=series2, metadata={})
+        preparer.save_to_file(path)
+        store = pd.HDFStore(path=path, mode="r")
+        saved = store.get("Group")
+        store.close()
+        os.remove(path)
+        assert sorted(saved["MyValueColumn"]) == [4.0, 6.0]
+
+    def test__add_values__duplicate_index_large_ints__summed_exactly(self):
+        path = "./deleteFile.hdf5"
+        preparer = DataPreparer()
+        preparer.init_data_group(group="Group", key_metadata={"ColA": column_metadata(label="A")})
+        series = pd.Series(data=[2 ** 60, 1], index=[0, 0], name="MyValueColumn")
+        series.index.name = "ColA"
+        preparer.add_values(group="Group", series=series, metadata=column_metadata(label="SomeLabel"))
+        preparer.save_to_file(path)
+        store = pd.HDFStore(path=path, mode="r")
+        saved = store.get("Group")
+        store.close()
+        os.remove(path)
+        assert list(saved["MyValueColumn"]) == [2 ** 60 + 1]
+
+    def test__add_values__duplicate_multi_index__summed_on_save(self):
+        path = "./deleteFile.hdf5"
+        preparer = DataPreparer()
+        preparer.init_data_group(group="Group", key_metadata={"ColA": column_metadata(label="A"),
+                                                              "ColB": column_metadata(label="B")})
+        index = pd.MultiIndex.from_tuples([("y", 2), ("x", 1)], names=["ColA", "ColB"])
+        for data in [[1.0, 2.0], [3.0, 4.0]]:
+            series = pd.Series(data=data, index=index, name="MyValueColumn")
+            preparer.add_values(group="Group", series=series, metadata=column_metadata(label="SomeLabel"))
+        preparer.save_to_file(path)
+        store = pd.HDFStore(path=path, mode="r")
+        saved = store.get("Group")
+        store.close()
+        os.remove(path)
+        assert list(saved["MyValueColumn"]) == [4.0, 6.0]
+        assert list(saved.index) == [("y", 2), ("x", 1)]
+
     def test__add_values__existing_column__metadata_ignored(self):
         preparer = DataPreparer()
         preparer.init_data_group(group="Group", key_metadata={"ColA": column_metadata(label="A")})